@@ -415,11 +415,12 @@ class Process:
 
         return True
 
-    def execute(self, path, args=None, suspended=False, kernel_analysis=False):
+    def execute(self, path, args=None, suspended=False, kernel_analysis=False, cwd=None):
         """Execute sample process.
         @param path: sample path.
         @param args: process args.
         @param suspended: is suspended.
+        @param cwd: working directory, overrides the executiondir/curdir options.
         @return: operation status.
         """
         if not os.access(path, os.X_OK):
@@ -445,7 +446,9 @@ class Process:
 
         # Use the custom execution directory if provided, otherwise launch in the same location
         # where the sample resides (default %TEMP%)
-        if "executiondir" in self.options.keys():
+        if cwd:
+            execution_directory = cwd
+        elif "executiondir" in self.options.keys():
             execution_directory = self.options["executiondir"]
         elif "curdir" in self.options.keys():
             execution_directory = self.options["curdir"]
@@ -8,6 +8,7 @@ import inspect
 import logging
 import os
 import shutil
+from functools import wraps
 
 from lib.api.process import Process
 from lib.common.common import check_file_extension, disable_wow64_redirection
@@ -20,7 +21,31 @@ from lib.core.compound import create_custom_folders
 
 log = logging.getLogger(__name__)
 
-PE_INDICATORS = [b"MZ", b"This program cannot be run in DOS mode"]
+# Only the start of the file is needed to tell whether it looks like a PE
+PE_HEADER_WINDOW = 4096
+DOS_STUB_MESSAGE = b"This program cannot be run in DOS mode"
+
+# File extensions that require cmd.exe, wscript.exe and rundll32.exe/regsvr32.exe to run
+CMD_EXTENSIONS = (".lnk", ".bat", ".cmd")
+WSCRIPT_EXTENSIONS = (".js", ".jse", ".vbs", ".vbe", ".wsf")
+DLL_EXTENSIONS = (".dll", ".db", ".dat", ".tmp", ".temp")
+
+
+def cache_path_lookup(func):
+    """Cache the paths found by a Package lookup method on the package instance.
+    Failed lookups still raise and are not cached.
+    """
+
+    @wraps(func)
+    def wrapper(self, application):
+        # Not every package calls Package.__init__, so the cache is created on first use
+        path_cache = self.__dict__.setdefault("_path_cache", {})
+        key = (func.__name__, application)
+        if key not in path_cache:
+            path_cache[key] = func(self, application)
+        return path_cache[key]
+
+    return wrapper
 
 
 class Package:
@@ -119,6 +144,7 @@ class Package:
             else:
                 yield os.path.join(*path)
 
+    @cache_path_lookup
     def get_path(self, application):
         """Search for the application in all available paths.
         @param application: application executable name
@@ -130,6 +156,7 @@ class Package:
 
         raise CuckooPackageError(f"Unable to find any {application} executable")
 
+    @cache_path_lookup
     def get_path_glob(self, application):
         """Search for the application in all available paths with glob support.
         @param application: application executable name
@@ -142,6 +169,7 @@ class Package:
 
         raise CuckooPackageError(f"Unable to find any {application} executable")
 
+    @cache_path_lookup
     def get_path_app_in_path(self, application):
         """Search for the application in all available paths.
         @param application: application executable name
@@ -153,11 +181,28 @@ class Package:
 
         raise CuckooPackageError(f"Unable to find any {application} executable")
 
-    def execute(self, path, args, interest):
+    def copy_dll_loader(self, loader, name):
+        """Copy the DLL loader next to itself under the name given by the dllloader option.
+        Archives can contain several DLLs run with the same loader, it is only copied again
+        when the copy was last made from a different loader.
+        @param loader: rundll32.exe/regsvr32.exe path
+        @param name: new loader file name
+        @return: path of the copy
+        """
+        newname = os.path.join(os.path.dirname(loader), name)
+        # rundll32.exe and regsvr32.exe copies end up at the same path, remember which one is there
+        dll_loader_copies = self.__dict__.setdefault("_dll_loader_copies", {})
+        if dll_loader_copies.get(newname) != loader:
+            shutil.copy(loader, newname)
+            dll_loader_copies[newname] = loader
+        return newname
+
+    def execute(self, path, args, interest, cwd=None):
         """Starts an executable for analysis.
         @param path: executable path
         @param args: executable arguments
         @param interest: file of interest, passed to the cuckoomon config
+        @param cwd: working directory of the new process
         @return: process pid
         """
         free = self.options.get("free", False)
@@ -166,7 +211,7 @@ class Package:
         kernel_analysis = bool(self.options.get("kernel_analysis", False))
 
         p = Process(options=self.options, config=self.config)
-        if not p.execute(path=path, args=args, suspended=suspended, kernel_analysis=kernel_analysis):
+        if not p.execute(path=path, args=args, suspended=suspended, kernel_analysis=kernel_analysis, cwd=cwd):
             raise CuckooPackageError("Unable to execute the initial process, analysis aborted")
 
         if free:
@@ -223,30 +268,30 @@ class Package:
         """
         Based on file extension or file contents, run relevant analysis package
         """
+        lower_file_name = file_name.lower()
         # File extensions that require cmd.exe to run
-        if file_name.lower().endswith((".lnk", ".bat", ".cmd")):
+        if lower_file_name.endswith(CMD_EXTENSIONS):
             cmd_path = self.get_path("cmd.exe")
-            cmd_args = f'/c "cd ^"{root}^" && start /wait ^"^" ^"{file_path}^"'
-            return self.execute(cmd_path, cmd_args, file_path)
+            cmd_args = f'/c start /wait "" "{file_path}"'
+            return self.execute(cmd_path, cmd_args, file_path, cwd=root)
         # File extensions that require msiexec.exe to run
-        elif file_name.lower().endswith(".msi"):
+        elif lower_file_name.endswith(".msi"):
             msi_path = self.get_path("msiexec.exe")
             msi_args = f'/I "{file_path}"'
             return self.execute(msi_path, msi_args, file_path)
         # File extensions that require wscript.exe to run
-        elif file_name.lower().endswith((".js", ".jse", ".vbs", ".vbe", ".wsf")):
-            cmd_path = self.get_path("cmd.exe")
+        elif lower_file_name.endswith(WSCRIPT_EXTENSIONS):
             wscript = self.get_path_app_in_path("wscript.exe")
-            cmd_args = f'/c "cd ^"{root}^" && {wscript} ^"{file_path}^"'
-            return self.execute(cmd_path, cmd_args, file_path)
+            return self.execute(wscript, f'"{file_path}"', file_path, cwd=root)
         # File extensions that require rundll32.exe/regsvr32.exe to run
-        elif file_name.lower().endswith((".dll", ".db", ".dat", ".tmp", ".temp")):
+        elif lower_file_name.endswith(DLL_EXTENSIONS):
             # We are seeing techniques where dll files are named with the .db/.dat/.tmp/.temp extensions
-            if not file_name.lower().endswith(".dll"):
+            if not lower_file_name.endswith(".dll"):
                 # Let's confirm that at least this is a PE
                 with open(file_path, "rb") as f:
-                    if not any(PE_indicator in f.read() for PE_indicator in PE_INDICATORS):
-                        return
+                    head = f.read(PE_HEADER_WINDOW)
+                if not (head.startswith(b"MZ") or DOS_STUB_MESSAGE in head):
+                    return
             dll_export = choose_dll_export(file_path)
             if dll_export == "DllRegisterServer":
                 rundll32 = self.get_path("regsvr32.exe")
@@ -259,17 +304,15 @@ class Package:
             if arguments:
                 dll_args += f" {arguments}"
             if dllloader:
-                newname = os.path.join(os.path.dirname(rundll32), dllloader)
-                shutil.copy(rundll32, newname)
-                rundll32 = newname
+                rundll32 = self.copy_dll_loader(rundll32, dllloader)
             return self.execute(rundll32, dll_args, file_path)
         # File extensions that require powershell.exe to run
-        elif file_name.lower().endswith(".ps1"):
+        elif lower_file_name.endswith(".ps1"):
             powershell = self.get_path_app_in_path("powershell.exe")
             args = f'-NoProfile -ExecutionPolicy bypass -File "{file_path}"'
             return self.execute(powershell, args, file_path)
         # File extensions that require winword.exe/wordview.exe to run
-        elif file_name.lower().endswith(".doc"):
+        elif lower_file_name.endswith(".doc"):
             # Try getting winword or wordview as a backup
             try:
                 word = self.get_path_glob("WINWORD.EXE")
@@ -277,12 +320,12 @@ class Package:
                 word = self.get_path_glob("WORDVIEW.EXE")
             return self.execute(word, f'"{file_path}" /q', file_path)
         # File extensions that require excel.exe to run
-        elif file_name.lower().endswith(".xls"):
+        elif lower_file_name.endswith(".xls"):
             # Try getting excel
             excel = self.get_path_glob("EXCEL.EXE")
             return self.execute(excel, f'"{file_path}" /q', file_path)
         # File extensions that require iexplore.exe to run
-        elif file_name.lower().endswith(".html"):
+        elif lower_file_name.endswith(".html"):
             edge = self.get_path("msedge.exe")
             return self.execute(edge, f'"{file_path}"', file_path)
         # File extensions that are portable executables
@@ -297,8 +340,8 @@ class Package:
                 os.rename(file_path, new_path)
                 file_path = new_path
             cmd_path = self.get_path("cmd.exe")
-            cmd_args = f'/c "cd ^"{root}^" && start /wait ^"^" ^"{file_path}^"'
-            return self.execute(cmd_path, cmd_args, file_path)
+            cmd_args = f'/c start /wait "" "{file_path}"'
+            return self.execute(cmd_path, cmd_args, file_path, cwd=root)
 
 
 class Auxiliary:
@@ -2,7 +2,12 @@
 # This file is part of Cuckoo Sandbox - http://www.cuckoosandbox.org
 # See the file 'docs/LICENSE' for copying permission.
 
+import mmap
+import os
+
 BUFSIZE = 1024 * 1024
+MMAP_LIMIT = 128 * 1024 * 1024
+MMAP_BUFSIZE = 16 * 1024 * 1024
 
 
 def hash_file(method, path):
@@ -18,3 +23,28 @@ def hash_file(method, path):
             h.update(buf)
             buf = f.read(BUFSIZE)
     return h.hexdigest()
+
+
+def hash_file_mapped(method, path):
+    """Calculates an hash on a file by path, mapping it in memory so the
+    whole content is handed to the hashing method in a single update.
+    Files bigger than MMAP_LIMIT are read in MMAP_BUFSIZE chunks instead.
+    @param method: callable hashing method
+    @param path: file path
+    @return: computed hash string
+    """
+    h = method()
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        # Empty files can't be mapped
+        if 0 < size <= MMAP_LIMIT:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                h.update(mm)
+        elif size:
+            buf = bytearray(MMAP_BUFSIZE)
+            view = memoryview(buf)
+            read = f.readinto(buf)
+            while read:
+                h.update(view[:read])
+                read = f.readinto(buf)
+    return h.hexdigest()
@@ -3,22 +3,19 @@ import logging
 import os
 import shutil
 import subprocess
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from zipfile import BadZipfile, ZipFile
 
-try:
-    import re2 as re
-except ImportError:
-    import re
-
 from lib.common.exceptions import CuckooPackageError
-from lib.common.hashing import hash_file
+from lib.common.hashing import hash_file_mapped
 from lib.common.results import upload_to_host
 
 log = logging.getLogger(__name__)
 
-FILE_NAME_REGEX = re.compile("[\s]{2}((?:[a-zA-Z0-9\.\-,_\\\\]+( [a-zA-Z0-9\.\-,_\\\\]+)?)+)\\r")
-FILE_EXT_OF_INTEREST = [
+UPLOAD_WORKERS = 8
+
+FILE_EXT_OF_INTEREST = (
     ".bat",
     ".cmd",
     ".dat",
@@ -39,7 +36,7 @@ FILE_EXT_OF_INTEREST = [
     ".vbs",
     ".wsf",
     ".xls",
-]
+)
 
 
 def extract_archive(seven_zip_path, archive_path, extract_path, password="infected", try_multiple_passwords=False):
@@ -51,15 +48,16 @@ def extract_archive(seven_zip_path, archive_path, extract_path, password="infect
     @param try_multiple_passwords: we will be splitting the password on the ':' symbol,
            and trying each one to extract the archive
     """
-    log.debug([seven_zip_path, "x", "-p", "-y", f"-o{extract_path}", archive_path])
+    args = [seven_zip_path, "x", "-p", "-y", f"-o{extract_path}", archive_path]
+    log.debug("%s", args)
     p = subprocess.run(
-        [seven_zip_path, "x", "-p", "-y", f"-o{extract_path}", archive_path],
+        args,
         stdin=subprocess.DEVNULL,
         stderr=subprocess.PIPE,
         stdout=subprocess.PIPE,
     )
     stdoutput, stderr = p.stdout, p.stderr
-    log.debug(f"{p.stdout} {p.stderr}")
+    log.debug("%s %s", stdoutput, stderr)
 
     if try_multiple_passwords:
         passwords = password.split(":")
@@ -67,7 +65,8 @@ def extract_archive(seven_zip_path, archive_path, extract_path, password="infect
         passwords = [password]
 
     if b"Wrong password" in stderr:
-        if not Path(extract_path).match("local\\temp"):
+        # Never wipe the user's TEMP folder
+        if "local\\temp" not in extract_path.lower():
             shutil.rmtree(extract_path, ignore_errors=True)
 
         # Default stderr, to be set at each iteration
@@ -75,17 +74,18 @@ def extract_archive(seven_zip_path, archive_path, extract_path, password="infect
 
         # Let's try every password in our password list until we get it right
         for pword in passwords:
-            log.debug([seven_zip_path, "x", f"-p{pword}", "-y", f"-o{extract_path}", archive_path])
+            args = [seven_zip_path, "x", f"-p{pword}", "-y", f"-o{extract_path}", archive_path]
+            log.debug("%s", args)
             p = subprocess.run(
-                [seven_zip_path, "x", f"-p{pword}", "-y", f"-o{extract_path}", archive_path],
+                args,
                 stdin=subprocess.DEVNULL,
                 stderr=subprocess.PIPE,
                 stdout=subprocess.PIPE,
             )
             stdoutput, stderr = p.stdout, p.stderr
-            log.debug(f"{p.stdout} {p.stderr}")
+            log.debug("%s %s", stdoutput, stderr)
             if b"Wrong password" in stderr:
-                log.debug(f"The provided password '{pword}' was incorrect")
+                log.debug("The provided password '%s' was incorrect", pword)
                 continue
             else:
                 # We did it!
@@ -106,39 +106,44 @@ def get_file_names(seven_zip_path, archive_path):
     @param archive_path: archive file path
     @return: A list of file names
     """
-    log.debug([seven_zip_path, "l", archive_path])
-    p = subprocess.run(
-        [seven_zip_path, "l", archive_path], stdin=subprocess.DEVNULL, stderr=subprocess.PIPE, stdout=subprocess.PIPE
-    )
-    stdoutput = p.stdout.decode()
-    stdoutput_lines = stdoutput.split("\n")
-
+    args = [seven_zip_path, "l", archive_path]
+    log.debug("%s", args)
     in_table = False
     items_under_header = False
+    name_col = 0
     file_names = []
-    for line in stdoutput_lines:
-        if in_table:
-            # This is a line in the table (header or footer separators)
-            if "-----" in line:
-                if items_under_header:
-                    items_under_header = False
-                else:
+    # Parse the listing while 7zip is still writing it, there is no need to keep the whole output around
+    with subprocess.Popen(
+        args,
+        stdin=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        encoding="utf-8",
+        errors="replace",
+    ) as p:
+        for line in p.stdout:
+            if in_table:
+                # This is a line in the table (header or footer separators)
+                if "-----" in line:
+                    if items_under_header:
+                        # Footer separator, only the totals are left
+                        p.terminate()
+                        break
                     items_under_header = True
-                continue
+                    continue
 
-            # These are the lines that we care about, since they contain the file names
-            if items_under_header:
-                # Find the end of the line (\r), note the carriage return since 7zip will run on Windows
-                file_name = re.search(FILE_NAME_REGEX, line)
-                if file_name:
-                    # The first capture group is the whole file name + returns
-                    # The second capture group is just the file name
-                    file_name = file_name.group(1)
-                    file_names.append(file_name)
-        else:
-            # Table Headers
-            if all(item.lower() in line.lower() for item in ("Date", "Time", "Attr", "Size", "Compressed", "Name")):
-                in_table = True
+                # These are the lines that we care about, since they contain the file names
+                if items_under_header:
+                    # The name is in the last column, strip the line ending since 7zip will run on Windows
+                    file_name = line[name_col:].rstrip("\r\n")
+                    if file_name:
+                        file_names.append(file_name)
+            else:
+                # Table Headers
+                if all(item.lower() in line.lower() for item in ("Date", "Time", "Attr", "Size", "Compressed", "Name")):
+                    in_table = True
+                    # 7zip uses a fixed column layout, the names start under the "Name" header
+                    name_col = line.lower().index("name")
 
     return file_names
 
@@ -151,95 +156,118 @@ def extract_zip(zip_path, extract_path, password=b"infected", recursion_depth=1,
     @param recursion_depth: how deep we are in a nested archive
     @param try_multiple_passwords: we will be splitting the password on the ':' symbol,
            and trying each one to extract the archive
+    @return: A list of the file names in the ZIP file
     """
-    # Test if zip file contains a file named as itself.
-    if is_overwritten(zip_path):
-        log.debug("ZIP file contains a file with the same name, original will be overwritten")
-        # TODO: add random string.
-        new_zip_path = f"{zip_path}.old"
-        shutil.move(zip_path, new_zip_path)
-        zip_path = new_zip_path
-
     # requires bytes not str
     if isinstance(password, str):
         password = password.encode()
 
-    # Extraction.
-    with ZipFile(zip_path, "r") as archive:
-        # Check if the archive is encrypted
-        for zip_info in archive.infolist():
-            is_encrypted = zip_info.flag_bits & 0x1
-            # If encrypted and the user didn't provide a password
-            # set to default value
-            if is_encrypted and (password in (b"", b"infected")):
-                log.debug("Archive is encrypted, using default password value: infected")
-                if password == b"":
-                    password = b"infected"
-                    break
-            # Else, either password stays as user specified or archive is not encrypted
-
-        if try_multiple_passwords:
-            passwords = password.split(b":")
-        else:
-            passwords = [password]
+    # If the user didn't provide a password set to default value,
+    # it is simply ignored when the archive is not encrypted
+    if not password:
+        password = b"infected"
 
-        # Let's try every password in our password list until we get it right
-        password_fail = False
-        for pword in passwords:
-            try:
-                archive.extractall(path=extract_path, pwd=pword)
-                password_fail = False
-                break
-            except BadZipfile as e:
-                raise CuckooPackageError("Invalid Zip file") from e
-            except RuntimeError as e:
-                if "Bad password for file" in repr(e):
-                    log.debug(f"Password '{pword}' was unsuccessful in extracting the archive.")
-                    password_fail = True
-                    continue
-                else:
-                    # Try twice, just for kicks
-                    try:
-                        archive.extractall(path=extract_path, pwd=pword)
-                    except RuntimeError as e:
-                        raise CuckooPackageError(f"Unable to extract Zip file: {e}") from e
-            finally:
-                if recursion_depth < 4:
-                    # Extract nested archives.
-                    for name in archive.namelist():
-                        if name.endswith(".zip"):
-                            # Recurse.
-                            try:
-                                extract_zip(
-                                    os.path.join(extract_path, name),
-                                    extract_path,
-                                    # Note that the password list is passed on, not the current password in the iteration
-                                    password=password,
-                                    recursion_depth=recursion_depth + 1,
-                                    try_multiple_passwords=try_multiple_passwords,
-                                )
-                            except BadZipfile:
-                                log.warning(
-                                    "Nested file '%s' name ends with .zip extension is not a valid Zip. Skip extraction", name
-                                )
-                            except RuntimeError as run_err:
-                                log.error("Error extracting nested Zip file %s with details: %s", name, run_err)
-
-        if password_fail:
-            raise CuckooPackageError(f"Unable to extract password-protected Zip file with the password(s): {passwords}")
-
-
-def is_overwritten(zip_path):
-    """Checks if the ZIP file contains another file with the same name, so it is going to be overwritten.
-    @param zip_path: zip file path
-    @return: comparison boolean
+    if try_multiple_passwords:
+        passwords = password.split(b":")
+    else:
+        passwords = [password]
+
+    # Nested archives are extracted from a worklist, in the same order as they appear in their parent
+    file_names = []
+    pending = [(zip_path, recursion_depth)]
+    while pending:
+        zip_path, depth = pending.pop()
+        try:
+            infos = _extract_zip_file(zip_path, extract_path, passwords)
+        except (BadZipfile, RuntimeError) as e:
+            # Errors in the archive we were asked to extract are for the caller to handle
+            if depth == recursion_depth:
+                if isinstance(e, BadZipfile):
+                    raise CuckooPackageError("Invalid Zip file") from e
+                raise
+            if isinstance(e, BadZipfile):
+                log.warning("Nested file '%s' name ends with .zip extension is not a valid Zip. Skip extraction", zip_path)
+            else:
+                log.error("Error extracting nested Zip file %s with details: %s", zip_path, e)
+            continue
+
+        if depth == recursion_depth:
+            file_names = [info.filename for info in infos]
+
+        if depth < 4:
+            # infolist() hands back the parsed central directory without building a new list of names,
+            # the same member can be listed more than once
+            nested = (info.filename for info in infos if info.filename.endswith(".zip") and not info.is_dir())
+            nested = list(dict.fromkeys(nested))
+            pending.extend((os.path.join(extract_path, name), depth + 1) for name in reversed(nested))
+
+    return file_names
+
+
+def _extract_zip_file(zip_path, extract_path, passwords):
+    """Extracts a single ZIP file, opening it only once unless it has to make room for a member named as itself.
+    @param zip_path: ZIP path
+    @param extract_path: where to extract
+    @param passwords: list of passwords to try
+    @return: ZipInfo list of the ZIP file
     """
     with ZipFile(zip_path, "r") as archive:
+        if not is_overwritten(zip_path, archive):
+            _extract_members(archive, extract_path, passwords)
+            return archive.infolist()
+
+    log.debug("ZIP file contains a file with the same name, original will be overwritten")
+    # TODO: add random string.
+    new_zip_path = f"{zip_path}.old"
+    shutil.move(zip_path, new_zip_path)
+    with ZipFile(new_zip_path, "r") as archive:
+        _extract_members(archive, extract_path, passwords)
+        return archive.infolist()
+
+
+def _extract_members(archive, extract_path, passwords):
+    """Extracts all members of an open ZIP file.
+    @param archive: ZipFile object
+    @param extract_path: where to extract
+    @param passwords: list of passwords to try
+    """
+    # Let's try every password in our password list until we get it right
+    password_fail = False
+    for pword in passwords:
         try:
-            # Test if zip file contains a file named as itself.
-            return any(name == os.path.basename(zip_path) for name in archive.namelist())
+            archive.extractall(path=extract_path, pwd=pword)
+            password_fail = False
+            break
         except BadZipfile as e:
             raise CuckooPackageError("Invalid Zip file") from e
+        except RuntimeError as e:
+            if "Bad password for file" in repr(e):
+                log.debug("Password '%s' was unsuccessful in extracting the archive.", pword)
+                password_fail = True
+                continue
+            else:
+                # Try twice, just for kicks
+                try:
+                    archive.extractall(path=extract_path, pwd=pword)
+                except RuntimeError as e:
+                    raise CuckooPackageError(f"Unable to extract Zip file: {e}") from e
+
+    if password_fail:
+        raise CuckooPackageError(f"Unable to extract password-protected Zip file with the password(s): {passwords}")
+
+
+def is_overwritten(zip_path, archive=None):
+    """Checks if the ZIP file contains another file with the same name, so it is going to be overwritten.
+    @param zip_path: zip file path
+    @param archive: ZipFile object of zip_path, if it is already open
+    @return: comparison boolean
+    """
+    if archive is None:
+        with ZipFile(zip_path, "r") as archive:
+            return is_overwritten(zip_path, archive)
+
+    # Test if zip file contains a file named as itself.
+    return os.path.basename(zip_path) in archive.namelist()
 
 
 def get_infos(zip_path):
@@ -255,44 +283,49 @@ def get_infos(zip_path):
 
 
 def winrar_extractor(winrar_binary, extract_path, archive_path):
-    log.debug([winrar_binary, "x", archive_path, extract_path])
+    args = [winrar_binary, "x", archive_path, extract_path]
+    log.debug("%s", args)
+    # The output is only ever logged, don't buffer it when it would be thrown away
+    debug = log.isEnabledFor(logging.DEBUG)
+    output = subprocess.PIPE if debug else subprocess.DEVNULL
     p = subprocess.run(
-        [winrar_binary, "x", archive_path, extract_path],
+        args,
         stdin=subprocess.DEVNULL,
-        stderr=subprocess.PIPE,
-        stdout=subprocess.PIPE,
+        stderr=output,
+        stdout=output,
     )
-    # stdoutput, stderr = p.stdout, p.stderr
-    log.debug(p.stdout + p.stderr)
+    if debug:
+        log.debug("%s%s", p.stdout, p.stderr)
 
-    return os.listdir(extract_path)
+    # Callers compare these names against 7zip's listing, so return names rather than DirEntry objects
+    with os.scandir(extract_path) as entries:
+        return [entry.name for entry in entries]
 
 
 def get_interesting_files(file_names):
     """
-    Using a regular expression that matches interesting file extensions, return interesting files
+    Using the tuple of interesting file extensions, return interesting files
     """
-    interesting_files = []
-
-    for f in file_names:
-        if any(f.lower().endswith(file_ext) for file_ext in FILE_EXT_OF_INTEREST):
-            interesting_files.append(f)
-
-    return interesting_files
+    return [f for f in file_names if f.lower().endswith(FILE_EXT_OF_INTEREST)]
 
 
 def upload_extracted_files(root, files_at_root):
     """
     Upload each file that was extracted, for further analysis
     """
-    for entry in files_at_root:
+
+    def upload_one(entry):
         try:
             file_path = os.path.join(root, entry)
-            log.info("Uploading {0} to host".format(file_path))
-            filename = f"files/{hash_file(hashlib.sha256, file_path)}"
+            log.info("Uploading %s to host", file_path)
+            filename = f"files/{hash_file_mapped(hashlib.sha256, file_path)}"
             upload_to_host(file_path, filename, metadata=Path(entry).name, duplicated=False)
         except Exception as e:
-            log.warning(f"Couldn't upload file {Path(entry).name} to host {e}")
+            log.warning("Couldn't upload file %s to host %s", Path(entry).name, e)
+
+    # Hashing and uploading release the GIL, so files can overlap each other
+    with ThreadPoolExecutor(max_workers=min(UPLOAD_WORKERS, os.cpu_count() or 4)) as executor:
+        list(executor.map(upload_one, files_at_root))
 
 
 def attempt_multiple_passwords(options: dict, password: str) -> bool:
@@ -308,9 +341,9 @@ def attempt_multiple_passwords(options: dict, password: str) -> bool:
 
 
 def get_zip_file_names(zip_path):
-    """Get information from ZIP file.
+    """Get the file names from ZIP file.
     @param zip_path: zip file path
-    @return: ZipInfo class
+    @return: A list of file names
     """
     try:
         with ZipFile(zip_path, "r") as archive:
@@ -12,7 +12,6 @@ from lib.common.zip_utils import (
     extract_archive,
     extract_zip,
     get_file_names,
-    get_infos,
     get_interesting_files,
     upload_extracted_files,
 )
@@ -47,10 +46,7 @@ class Zip(Package):
         root = os.environ["APPDATA"] if appdata else os.environ["TEMP"]
         file_names = []
         try:
-            zipinfos = get_infos(path)
-            extract_zip(path, root, password, 0, try_multiple_passwords)
-            for f in zipinfos:
-                file_names.append(f.filename)
+            file_names = extract_zip(path, root, password, 0, try_multiple_passwords)
         except CuckooPackageError as e:
             # We should not be trying to do other things if we cannot extract the initial
             # password-protected zip file
@@ -1,4 +1,7 @@
 import importlib
+import os
+import shutil
+import tempfile
 import unittest
 from unittest.mock import MagicMock, patch
 
@@ -36,3 +39,60 @@ class TestPackageConfiguration(unittest.TestCase):
             # check it imported the private configuration module
             m.assert_called_once_with(module_name)
         self.assertTrue(configure_called)
+
+
+class TestPackagePaths(unittest.TestCase):
+    CMD_PATH = "C:\\Windows\\system32\\cmd.exe"
+
+    def test_get_path_cached(self):
+        pkg = abstracts.Package()
+        with patch.object(abstracts.Package, "enum_paths", return_value=[self.CMD_PATH]) as enum_paths, patch(
+            "os.path.isfile", return_value=True
+        ):
+            self.assertEqual(pkg.get_path("cmd.exe"), self.CMD_PATH)
+            self.assertEqual(pkg.get_path("cmd.exe"), self.CMD_PATH)
+            enum_paths.assert_called_once()
+
+            # The cache belongs to the instance
+            self.assertEqual(abstracts.Package().get_path("cmd.exe"), self.CMD_PATH)
+            self.assertEqual(enum_paths.call_count, 2)
+
+    def test_get_path_cached_per_method(self):
+        pkg = abstracts.Package()
+        with patch.object(abstracts.Package, "enum_paths", return_value=[self.CMD_PATH]) as enum_paths, patch(
+            "os.path.isfile", return_value=True
+        ):
+            self.assertEqual(pkg.get_path("cmd.exe"), self.CMD_PATH)
+            self.assertEqual(pkg.get_path_app_in_path("cmd.exe"), self.CMD_PATH)
+            self.assertEqual(enum_paths.call_count, 2)
+
+    def test_get_path_not_found(self):
+        pkg = abstracts.Package()
+        with patch.object(abstracts.Package, "enum_paths", return_value=[self.CMD_PATH]) as enum_paths, patch(
+            "os.path.isfile", return_value=False
+        ):
+            for _ in range(2):
+                with self.assertRaises(abstracts.CuckooPackageError):
+                    pkg.get_path("cmd.exe")
+            self.assertEqual(enum_paths.call_count, 2)
+
+
+class TestCopyDllLoader(unittest.TestCase):
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.loaders = {}
+        for loader in ("rundll32.exe", "regsvr32.exe"):
+            self.loaders[loader] = os.path.join(tmpdir.name, loader)
+            with open(self.loaders[loader], "w") as f:
+                f.write(loader)
+
+    def test_copy_dll_loader_mixed_loaders(self):
+        pkg = abstracts.Package()
+        with patch.object(shutil, "copy", wraps=shutil.copy) as copy:
+            for loader in ("regsvr32.exe", "rundll32.exe", "regsvr32.exe", "regsvr32.exe"):
+                newname = pkg.copy_dll_loader(self.loaders[loader], "loader.exe")
+                with open(newname) as f:
+                    self.assertEqual(f.read(), loader)
+        # Reusing the loader that is already in place doesn't copy it again
+        self.assertEqual(copy.call_count, 3)
@@ -0,0 +1,117 @@
+import io
+import os
+import subprocess
+import tempfile
+import unittest
+import zipfile
+from unittest.mock import patch
+
+from lib.common import zip_utils
+from lib.common.exceptions import CuckooPackageError
+
+SEVEN_ZIP_LISTING = (
+    "\r\n"
+    "7-Zip 22.01 (x64) : Copyright (c) 1999-2022 Igor Pavlov : 2022-07-15\r\n"
+    "\r\n"
+    "Scanning the drive for archives:\r\n"
+    "1 file, 1234 bytes (2 KiB)\r\n"
+    "\r\n"
+    "Listing archive: sample.zip\r\n"
+    "\r\n"
+    "--\r\n"
+    "Path = sample.zip\r\n"
+    "Type = zip\r\n"
+    "Physical Size = 1234\r\n"
+    "\r\n"
+    "   Date      Time    Attr         Size   Compressed  Name\r\n"
+    "------------------- ----- ------------ ------------  ------------------------\r\n"
+    "2023-01-01 12:00:00 D....            0            0  folder\r\n"
+    "2023-01-01 12:00:00 ....A         1024          512  folder\\invoice 2023.exe\r\n"
+    "2023-01-01 12:00:00 ....A          512          256  readme (1).txt\r\n"
+    "------------------- ----- ------------ ------------  ------------------------\r\n"
+    "2023-01-01 12:00:00               1536          768  2 files, 1 folders\r\n"
+)
+
+
+class TestGetFileNames(unittest.TestCase):
+    def get_file_names(self, listing):
+        with patch.object(subprocess, "Popen") as popen:
+            popen.return_value.__enter__.return_value.stdout = io.StringIO(listing)
+            return zip_utils.get_file_names("7z.exe", "sample.zip")
+
+    def test_get_file_names(self):
+        file_names = self.get_file_names(SEVEN_ZIP_LISTING)
+        self.assertEqual(file_names, ["folder", "folder\\invoice 2023.exe", "readme (1).txt"])
+
+    def test_get_file_names_pathological_name(self):
+        # Names like this one made the old backtracking regex take exponential time
+        name = "a " * 5000 + "!.exe"
+        row = "2023-01-01 12:00:00 ....A         1024          512  " + name + "\r\n"
+        listing = SEVEN_ZIP_LISTING.replace("2023-01-01 12:00:00 ....A          512          256  readme (1).txt\r\n", row)
+        self.assertEqual(self.get_file_names(listing), ["folder", "folder\\invoice 2023.exe", name])
+
+    def test_get_file_names_not_an_archive(self):
+        self.assertEqual(self.get_file_names("Can not open the file as archive\r\n"), [])
+
+
+class TestGetInterestingFiles(unittest.TestCase):
+    def test_get_interesting_files(self):
+        file_names = ["a.EXE", "b.txt", "folder\\c.lnk", "d.ps1.bak"]
+        self.assertEqual(zip_utils.get_interesting_files(file_names), ["a.EXE", "folder\\c.lnk"])
+
+
+def make_zip(members):
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w") as archive:
+        for name, content in members:
+            archive.writestr(name, content)
+    return buf.getvalue()
+
+
+class TestExtractZip(unittest.TestCase):
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.tmpdir = tmpdir.name
+        self.extract_path = os.path.join(self.tmpdir, "out")
+
+    def extract(self, members, **kwargs):
+        zip_path = os.path.join(self.tmpdir, "sample.zip")
+        with open(zip_path, "wb") as f:
+            f.write(make_zip(members))
+        zip_utils.extract_zip(zip_path, self.extract_path, **kwargs)
+        return sorted(os.listdir(self.extract_path))
+
+    def test_extract_nested(self):
+        level3 = make_zip([("level3.txt", "3")])
+        level2 = make_zip([("level2.txt", "2"), ("level3.zip", level3)])
+        members = [("level1.txt", "1"), ("level2.zip", level2), ("invalid.zip", "not a zip")]
+        self.assertEqual(
+            self.extract(members, password=""),
+            ["invalid.zip", "level1.txt", "level2.txt", "level2.zip", "level3.txt", "level3.zip"],
+        )
+
+    def test_extract_nested_depth_limit(self):
+        level3 = make_zip([("level3.txt", "3")])
+        level2 = make_zip([("level2.txt", "2"), ("level3.zip", level3)])
+        members = [("level1.txt", "1"), ("level2.zip", level2)]
+        self.assertEqual(self.extract(members, recursion_depth=3), ["level1.txt", "level2.txt", "level2.zip", "level3.zip"])
+
+    def test_extract_returns_file_names(self):
+        level2 = make_zip([("level2.txt", "2")])
+        zip_path = os.path.join(self.tmpdir, "sample.zip")
+        with open(zip_path, "wb") as f:
+            f.write(make_zip([("level1.txt", "1"), ("level2.zip", level2)]))
+        self.assertEqual(zip_utils.extract_zip(zip_path, self.extract_path), ["level1.txt", "level2.zip"])
+
+    def test_extract_member_named_as_archive(self):
+        members = [("sample.zip", make_zip([("inner.txt", "inner")])), ("outer.txt", "outer")]
+        self.assertEqual(self.extract(members), ["inner.txt", "outer.txt", "sample.zip"])
+        self.assertTrue(os.path.exists(os.path.join(self.tmpdir, "sample.zip.old")))
+
+    def test_extract_invalid(self):
+        zip_path = os.path.join(self.tmpdir, "invalid.zip")
+        with open(zip_path, "wb") as f:
+            f.write(b"not a zip")
+        with self.assertRaises(CuckooPackageError):
+            zip_utils.extract_zip(zip_path, self.extract_path)